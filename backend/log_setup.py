@@ -0,0 +1,44 @@
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+class SkipDebugPaths(logging.Filter):
+    """Drop uvicorn access records for /debug/* so polling them stays quiet"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # uvicorn.access args: (client_addr, method, path, http_version, status_code)
+        args = record.args
+        if isinstance(args, tuple) and len(args) >= 3 and str(args[2]).startswith("/debug"):
+            return False
+        return True
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """Route the root and uvicorn access loggers through a queue
+
+    Handlers only enqueue the record; formatting and the write to stderr
+    happen on the listener's thread, off the event loop. Call after uvicorn
+    has applied its own logging config (i.e. from the app lifespan), and
+    stop the returned listener on shutdown to flush what is left.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    access_logger = logging.getLogger("uvicorn.access")
+    access_logger.handlers = [queue_handler]
+    access_logger.propagate = False
+    access_logger.addFilter(SkipDebugPaths())
+
+    listener.start()
+    return listener
@@ -1,18 +1,37 @@
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, HTTPException, status, Depends, Request, Header, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
+from fastapi.responses import RedirectResponse, ORJSONResponse
+from pydantic import BaseModel, ValidationError, constr
 from fastapi.middleware.cors import CORSMiddleware
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Dict, Optional, List
-import threading
+from operator import itemgetter
+from typing import Dict, Optional, List, Set, Tuple
+from collections import deque
+from enum import IntEnum
+from itertools import count
+import asyncio
 import time
-import requests
+import hashlib
+import hmac
+import httpx
+import orjson
 import os
+import secrets
+import uuid
 from urllib.parse import urlencode
+from cachetools import TTLCache
+import logging
 
 # Import Supabase client
-from supabase_client import supabase_repo
+from supabase_client import SupabaseRepository, get_supabase_repo, SUPABASE_URL, SUPABASE_KEY
+
+# Import shared state store (Redis or in-memory)
+from state_store import state_store, REDIS_URL
+from log_setup import configure_logging
+
+logger = logging.getLogger(__name__)
 
 # Configuration from environment variables
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
@@ -20,13 +39,341 @@ BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
 # Try to import Portia, fallback if not available
 try:
-    from portia_setup import portia, task0
+    from portia import PlanRunState
+    from portia_setup import run_task as run_portia_task, task0, is_short_task, use_lite_model
     PORTIA_AVAILABLE = True
 except ImportError:
     PORTIA_AVAILABLE = False
-    print("Warning: Portia not available. Automation features will be disabled.")
+    logger.warning("Portia not available. Automation features will be disabled.")
+
+# Automation job queue: bounded local pool by default, RQ on Redis when
+# AUTOMATION_QUEUE=rq. RQ is opt-in because its jobs only run once a
+# separate `rq worker github-automation` process is started.
+AUTOMATION_QUEUE = os.getenv("AUTOMATION_QUEUE", "local").lower()
+AUTOMATION_QUEUE_NAME = "github-automation"
+AUTOMATION_WORKERS = int(os.getenv("AUTOMATION_WORKERS", "4"))
+AUTOMATION_MAX_PENDING = int(os.getenv("AUTOMATION_MAX_PENDING", "64"))
+
+# Enqueueing is a blocking redis-py call made off the event loop; the timeout
+# bounds how long a handler waits on an unreachable Redis
+RQ_SOCKET_TIMEOUT_SECONDS = 5
+
+try:
+    from redis import Redis, RedisError
+    from rq import Queue
+    RQ_AVAILABLE = True
+except ImportError:
+    RQ_AVAILABLE = False
+
+automation_queue = None
+if AUTOMATION_QUEUE == "rq":
+    if RQ_AVAILABLE and REDIS_URL:
+        automation_queue = Queue(AUTOMATION_QUEUE_NAME, connection=Redis.from_url(
+            REDIS_URL,
+            socket_timeout=RQ_SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=RQ_SOCKET_TIMEOUT_SECONDS
+        ))
+    else:
+        logger.warning("AUTOMATION_QUEUE=rq needs rq installed and REDIS_URL set; using the local queue")
+
+# Portia is synchronous, so its calls run on bounded pools. automation_executor
+# only serves RQ worker processes; in the API process automations share
+# portia_executor with /run-task through the priority-aware batchers below.
+automation_executor = ThreadPoolExecutor(max_workers=AUTOMATION_WORKERS, thread_name_prefix="automation")
+
+PORTIA_MAX_IN_FLIGHT = int(os.getenv("PORTIA_MAX_IN_FLIGHT", "8"))
+portia_executor = ThreadPoolExecutor(max_workers=PORTIA_MAX_IN_FLIGHT, thread_name_prefix="portia")
+
+# One slot per portia_executor thread, shared by every batcher. Tasks only
+# leave their queue once a slot is free, so the executor's own FIFO queue
+# never builds up and priority order is kept. A batcher claims a slot only
+# when it has a task waiting, so an idle bucket holds none.
+portia_slots = asyncio.Semaphore(PORTIA_MAX_IN_FLIGHT)
+
+class Priority(IntEnum):
+    HIGH = 0  # interactive /run-task
+    NORMAL = 1  # webhook-triggered automations
+    LOW = 2  # automation retries
+
+# (priority, sequence, task, use_lite, future, enqueued_at); sequence keeps FIFO within a priority
+QueuedTask = Tuple[int, int, str, bool, asyncio.Future, float]
+
+class PortiaBatcher:
+    """Groups Portia calls that arrive close together into one dispatch
+
+    Tasks wait in a priority queue, so interactive calls overtake queued
+    automations. A batch is closed max_latency seconds after its first task,
+    once max_batch_size tasks are taken, or when no executor slot is free.
+    Portia has no batch API, so the batch is only fanned out onto
+    portia_executor with asyncio.gather; holding tasks back would add latency
+    without saving a call, and max_latency therefore defaults to 0 (every
+    task is dispatched as soon as a slot is free).
+    """
+    
+    def __init__(self, max_batch_size: int = 16, max_latency: float = 0):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._queue: asyncio.PriorityQueue[QueuedTask] = asyncio.PriorityQueue()
+        self._sequence = count()
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+        
+        # Exposed by /debug/batch_stats
+        self.batches = 0
+        self.tasks = 0
+        self.max_observed_batch_size = 0
+        self.last_batch_size = 0
+        self.latencies: Dict[Priority, deque] = {priority: deque(maxlen=500) for priority in Priority}
+        self.waiting: Dict[Priority, int] = {priority: 0 for priority in Priority}  # queued, not yet taken
+    
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+    
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        for dispatch in self._dispatches:
+            dispatch.cancel()
+        await asyncio.gather(*self._dispatches, return_exceptions=True)
+        while not self._queue.empty():
+            priority, _, _, _, future, _ = self._queue.get_nowait()
+            self.waiting[Priority(priority)] -= 1
+            if not future.done():
+                future.set_exception(RuntimeError("Portia batcher stopped"))
+    
+    async def submit(self, task: str, use_lite: bool, priority: Priority = Priority.NORMAL):
+        """Queue a task and wait for its plan run"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiting[priority] += 1
+        await self._queue.put((priority, next(self._sequence), task, use_lite, future, loop.time()))
+        return await future
+    
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "tasks": self.tasks,
+            "average_batch_size": round(self.tasks / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_observed_batch_size,
+            "last_batch_size": self.last_batch_size,
+            "queued": self._queue.qsize(),
+            "p95_latency_seconds": {
+                priority.name.lower(): percentile(latencies, 0.95) for priority, latencies in self.latencies.items()
+            },
+        }
+    
+    async def _take(self):
+        """Wait for a task, then for a free slot, then take the highest-priority live task"""
+        while True:
+            first = await self._queue.get()
+            try:
+                await portia_slots.acquire()
+            finally:
+                # Put it back so a higher-priority task that arrived while we
+                # waited for the slot goes first
+                self._queue.put_nowait(first)
+            item = self._queue.get_nowait()
+            self.waiting[Priority(item[0])] -= 1
+            # Skip tasks whose submitter already gave up
+            if not item[4].done():
+                return item
+            portia_slots.release()
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._take()]
+            deadline = loop.time() + self.max_latency
+            
+            while len(batch) < self.max_batch_size and not portia_slots.locked():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._take(), timeout))
+                except TimeoutError:
+                    break
+            
+            self.batches += 1
+            self.tasks += len(batch)
+            self.last_batch_size = len(batch)
+            self.max_observed_batch_size = max(self.max_observed_batch_size, len(batch))
+            
+            # Keep collecting while this batch runs
+            dispatch = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, batch: List[QueuedTask]):
+        await asyncio.gather(*[self._run_one(*item) for item in batch])
+    
+    async def _run_one(self, priority: int, _sequence: int, task: str, use_lite: bool, future: asyncio.Future, enqueued_at: float):
+        loop = asyncio.get_running_loop()
+        work = loop.run_in_executor(portia_executor, run_portia_task, task, use_lite)
+        # The thread keeps running after a timeout, so the slot is freed when it
+        # actually finishes rather than when we stop waiting
+        work.add_done_callback(release_portia_slot)
+        try:
+            # Only the run itself is timed; time spent queued behind higher priorities is not
+            result = await asyncio.wait_for(asyncio.shield(work), timeout=PORTIA_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            self.latencies[Priority(priority)].append(loop.time() - enqueued_at)
+        # The submitter may have given up already
+        if not future.done():
+            future.set_result(result)
+
+def release_portia_slot(work: asyncio.Future):
+    if not work.cancelled():
+        work.exception()  # mark retrieved; a timed-out run's error has no other reader
+    portia_slots.release()
+
+def percentile(values, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+# Short prompts (the issue-labelling template) and long free-form tasks finish in
+# very different times, so each length bucket is batched separately
+portia_batchers: Dict[str, PortiaBatcher] = {"short": PortiaBatcher(), "long": PortiaBatcher()}
+
+async def dispatch_portia_task(task: str, priority: Priority, prompt: Optional[str] = None):
+    """Send a task through its length bucket's batcher
+
+    `prompt` is the task without any appended credentials. The bucket and
+    model tier are chosen from it, so the token does not change the routing.
+    """
+    prompt = prompt or task
+    use_lite = use_lite_model(prompt)
+    batcher = portia_batchers["short" if is_short_task(prompt) else "long"]
+    if batcher.running:
+        return await batcher.submit(task, use_lite, priority)
+    # RQ worker processes have no batchers; they run one job at a time anyway
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(
+        loop.run_in_executor(automation_executor, run_portia_task, task, use_lite),
+        timeout=PORTIA_TIMEOUT_SECONDS
+    )
+
+# In-flight local automation tasks, capped at AUTOMATION_MAX_PENDING and cancelled on shutdown
+automation_tasks: Set[asyncio.Task] = set()
+
+# Upper bound on a single portia.run; the worker thread cannot be killed, but the
+# automation is marked failed instead of sitting in "running" forever
+PORTIA_TIMEOUT_SECONDS = int(os.getenv("PORTIA_TIMEOUT_SECONDS", "120"))
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets a single
+    trial call through once `recovery_timeout` seconds have passed
+
+    Every call that `allow()` admits must end in `record_success`,
+    `record_failure` or `abandon_trial`.
+    """
+    
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 60):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+    
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial_in_flight:
+            return False
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            # Half-open: admit this call only; its outcome closes or re-opens the circuit
+            self.trial_in_flight = True
+            return True
+        return False
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+    
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+    
+    def abandon_trial(self):
+        """Free the half-open slot for a call that ended without an outcome"""
+        self.trial_in_flight = False
+
+# One breaker per repository so a single broken repo does not stop the others.
+# State is local to the process: each server worker keeps its own, and under RQ
+# every job runs in a freshly forked work-horse, so breakers only ever trip for
+# automations run on the local queue.
+portia_breakers: Dict[str, CircuitBreaker] = {}
+
+# Connection pool for api.github.com, sized for expected concurrency.
+# limits/http2 live on the transport because httpx ignores them on the
+# client once a custom transport is supplied.
+GITHUB_POOL_LIMITS = httpx.Limits(
+    max_keepalive_connections=50,
+    max_connections=100,
+    keepalive_expiry=60
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients on startup and close them on shutdown"""
+    log_listener = configure_logging()
+    await state_store.connect()
+    app.state.gh_client = httpx.AsyncClient(
+        timeout=10,
+        headers=GITHUB_JSON_ACCEPT,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=GITHUB_POOL_LIMITS,
+            retries=1
+        )
+    )
+    
+    supabase_repo = get_supabase_repo()
+    await supabase_repo.connect()
+    await supabase_repo.ping()
+    
+    if PORTIA_AVAILABLE:
+        for batcher in portia_batchers.values():
+            batcher.start()
+    
+    # Pre-warm the TLS session so the first user request reuses a live connection
+    try:
+        await app.state.gh_client.get("https://api.github.com/rate_limit")
+    except httpx.HTTPError as e:
+        logger.warning("GitHub connection warm-up failed: %s", e)
+    
+    yield
+    for task in automation_tasks:
+        task.cancel()
+    await asyncio.gather(*automation_tasks, return_exceptions=True)
+    for batcher in portia_batchers.values():
+        await batcher.stop()
+    await app.state.gh_client.aclose()
+    await state_store.close()
+    await supabase_repo.close()
+    automation_executor.shutdown(wait=False, cancel_futures=True)
+    portia_executor.shutdown(wait=False, cancel_futures=True)
+    log_listener.stop()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 origins = [
     FRONTEND_URL,  
@@ -40,30 +387,126 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
-# In-memory store for automation status
-# In production, this should be a proper database
-automation_status: Dict[str, Dict] = {}
+# Automation status, GitHub tokens and webhook secrets live in state_store
+# In production, tokens and secrets should also be encrypted at rest
 
-# In-memory store for GitHub access tokens
-# In production, this should be encrypted and stored in database
-github_tokens: Dict[str, str] = {}  # user_id -> github_token
+# In-memory store for repositories (fallback when Supabase not available)
+in_memory_repositories: Dict[str, Dict[str, Dict]] = {}  # user_id -> repository_id -> repository
+in_memory_repository_names: Dict[str, Dict[str, str]] = {}  # user_id -> full_name -> repository_id
 
-# In-memory store for webhook secrets  
-# In production, this should be encrypted and stored in database
-webhook_secrets: Dict[str, str] = {}  # repo_full_name -> webhook_secret
+# How long get_webhook_status trusts the webhook registry before revalidating
+WEBHOOK_REFRESH_SECONDS = 60
 
-# In-memory store for repositories (fallback when Supabase not available)
-in_memory_repositories: Dict[str, List[Dict]] = {}  # user_id -> repositories list
+# Short-lived cache of GitHub GET responses keyed by (kind, token_digest(token), ...)
+# Avoids re-validating the same token/repository on every poll
+github_response_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+# ETags outlive the response cache so expired entries can be revalidated
+# with a conditional request; a 304 does not count against the rate limit
+github_etag_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3600)  # key -> (etag, data)
+
+# Identical /run-task submissions within the TTL reuse the existing plan run
+task_cache: TTLCache = TTLCache(maxsize=1000, ttl=300)  # task digest -> plan_run.id
+# Runs still in progress, so identical concurrent submissions share one run
+task_runs_in_flight: Dict[str, asyncio.Task] = {}  # task digest -> run_portia task
+
+def task_cache_key(task: str) -> str:
+    return hashlib.blake2b(task.encode(), digest_size=16).hexdigest()
+
+def finish_task_run(cache_key: str, run: asyncio.Task):
+    """Cache a finished run's id unless it failed, so a resubmission can try again"""
+    task_runs_in_flight.pop(cache_key, None)
+    if run.cancelled() or run.exception() is not None:
+        return
+    plan_run = run.result()
+    if plan_run.state != PlanRunState.FAILED:
+        task_cache[cache_key] = str(plan_run.id)
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+# Aliases keep the REST field names the frontend already consumes
+GITHUB_REPOSITORIES_QUERY = """
+query($first: Int!, $after: String) {
+  viewer {
+    repositories(
+      first: $first
+      after: $after
+      orderBy: {field: UPDATED_AT, direction: DESC}
+      ownerAffiliations: [OWNER, COLLABORATOR, ORGANIZATION_MEMBER]
+    ) {
+      pageInfo { endCursor hasNextPage }
+      nodes {
+        id: databaseId
+        name
+        full_name: nameWithOwner
+        description
+        html_url: url
+        private: isPrivate
+        primaryLanguage { name }
+        stargazers_count: stargazerCount
+        forks_count: forkCount
+        issues(states: OPEN) { totalCount }
+        updated_at: updatedAt
+        viewerPermission
+        repositoryTopics(first: 20) { nodes { topic { name } } }
+      }
+    }
+  }
+}
+"""
+
+# GraphQL viewerPermission -> REST-style permissions object
+VIEWER_PERMISSIONS = {
+    "ADMIN": {"admin": True, "maintain": True, "push": True, "triage": True, "pull": True},
+    "MAINTAIN": {"admin": False, "maintain": True, "push": True, "triage": True, "pull": True},
+    "WRITE": {"admin": False, "maintain": False, "push": True, "triage": True, "pull": True},
+    "TRIAGE": {"admin": False, "maintain": False, "push": False, "triage": True, "pull": True},
+    "READ": {"admin": False, "maintain": False, "push": False, "triage": False, "pull": True},
+}
+
+# Fields copied as-is from REST repository objects; permissions/topics may be missing
+REST_REPOSITORY_FIELDS = (
+    "id", "name", "full_name", "description", "html_url", "clone_url", "private",
+    "language", "stargazers_count", "forks_count", "open_issues_count", "updated_at"
+)
+get_rest_repository_fields = itemgetter(*REST_REPOSITORY_FIELDS)
+
+# Shared defaults for missing fields; only ever serialized, never mutated
+EMPTY_PERMISSIONS: Dict = {}
+EMPTY_TOPICS = ()
+
+def format_graphql_repository(node: Dict) -> Dict:
+    """Flatten the nested GraphQL fields into the REST repository shape"""
+    language = node.pop("primaryLanguage")
+    node["clone_url"] = f"{node['html_url']}.git"
+    node["language"] = language["name"] if language else None
+    node["open_issues_count"] = node.pop("issues")["totalCount"]
+    node["permissions"] = VIEWER_PERMISSIONS.get(node.pop("viewerPermission"), {})
+    node["topics"] = [entry["topic"]["name"] for entry in node.pop("repositoryTopics")["nodes"]]
+    return node
 
 # GitHub OAuth configuration
 GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID", "your_github_client_id")
 GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET", "your_github_client_secret")
 GITHUB_REDIRECT_URI = os.getenv("GITHUB_REDIRECT_URI", f"{BACKEND_URL}/auth/github/callback")
 
+# OAuth URL only depends on configuration, so build it once
+GITHUB_AUTH_URL = "" if GITHUB_CLIENT_ID == "your_github_client_id" else (
+    "https://github.com/login/oauth/authorize?" + urlencode({
+        "client_id": GITHUB_CLIENT_ID,
+        "redirect_uri": GITHUB_REDIRECT_URI,
+        "scope": "repo,read:user",
+        "state": "github_auth"
+    })
+)
+
+GITHUB_JSON_ACCEPT = {"Accept": "application/vnd.github.v3+json"}
+
 security = HTTPBearer(auto_error=False)
 
 class TaskRequest(BaseModel):
-    task: str
+    # Blank tasks are rejected with a 422; the cap bounds what one request can spend on the LLM
+    task: constr(strip_whitespace=True, min_length=1, max_length=8192)
 
 class AutomationStatus(BaseModel):
     status: str  # "pending", "running", "completed", "failed"
@@ -89,27 +532,87 @@ class RepositoryCreateRequest(BaseModel):
     description: Optional[str] = None
     url: str
 
-def update_automation_status(repo_full_name: str, issue_number: int, status_data: Dict):
+# GitHub webhook payloads only declare the fields the handler reads;
+# everything else in the (often 10-50 KB) body is skipped during validation
+class WebhookOwner(BaseModel):
+    login: Optional[str] = None
+
+class WebhookRepository(BaseModel):
+    full_name: str
+    owner: Optional[WebhookOwner] = None
+
+class WebhookIssue(BaseModel):
+    number: int
+    repository_url: str
+
+class IssueWebhookPayload(BaseModel):
+    action: Optional[str] = None
+    issue: Optional[WebhookIssue] = None
+    repository: Optional[WebhookRepository] = None
+
+def github_headers(token: str) -> Dict[str, str]:
+    """GitHub API headers for a token; built per call so tokens are not kept after they are deleted"""
+    return {**GITHUB_JSON_ACCEPT, "Authorization": f"token {token}"}
+
+async def update_automation_status(repo_full_name: str, issue_number: int, status_data: Dict):
     """Update automation status for a specific issue"""
-    key = f"{repo_full_name}#{issue_number}"
-    automation_status[key] = status_data
+    await state_store.set_automation_status(repo_full_name, issue_number, status_data)
 
-def get_automation_status(repo_full_name: str, issue_number: int) -> Optional[Dict]:
+async def get_automation_status(repo_full_name: str, issue_number: int) -> Optional[Dict]:
     """Get automation status for a specific issue"""
-    key = f"{repo_full_name}#{issue_number}"
-    return automation_status.get(key)
+    return await state_store.get_automation_status(repo_full_name, issue_number)
 
-def get_github_token_for_user(user_id: str) -> Optional[str]:
+async def get_github_token_for_user(user_id: str) -> Optional[str]:
     """Get GitHub token for a user"""
-    return github_tokens.get(user_id)
+    return await state_store.get_github_token(user_id)
 
-def set_github_token_for_user(user_id: str, token: str):
+async def set_github_token_for_user(user_id: str, token: str):
     """Set GitHub token for a user"""
-    github_tokens[user_id] = token
+    await state_store.set_github_token(user_id, token)
+
+def token_digest(token: str) -> str:
+    """Stand-in for a token in cache keys, so raw tokens are not kept in memory as keys"""
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
 
-async def verify_repository_access(repo_full_name: str, user_id: str) -> Dict:
+async def delete_github_token_for_user(user_id: str, token: str):
+    """Remove a token GitHub rejected and drop the responses cached under it"""
+    await state_store.delete_github_token(user_id, token)
+    digest = token_digest(token)
+    for cache in (github_response_cache, github_etag_cache):
+        for key in [key for key in cache.keys() if key[1] == digest]:
+            cache.pop(key, None)
+
+async def fetch_github_cached(http: httpx.AsyncClient, cache_key: tuple, url: str, headers: Dict) -> tuple[int, Optional[Dict]]:
+    """GET a GitHub resource through the TTL cache, revalidating with ETags when stale"""
+    cached = github_response_cache.get(cache_key)
+    if cached is not None:
+        return 200, cached
+    
+    etag_entry = github_etag_cache.get(cache_key)
+    if etag_entry:
+        headers = {**headers, "If-None-Match": etag_entry[0]}
+    
+    response = await http.get(url, headers=headers)
+    
+    if response.status_code == 304 and etag_entry:
+        github_response_cache[cache_key] = etag_entry[1]
+        return 200, etag_entry[1]
+    
+    if response.status_code == 200:
+        data = response.json()
+        github_response_cache[cache_key] = data
+        etag = response.headers.get("etag")
+        if etag:
+            github_etag_cache[cache_key] = (etag, data)
+        return 200, data
+    
+    # Drop the stale ETag so an error is never masked by cached data later
+    github_etag_cache.pop(cache_key, None)
+    return response.status_code, None
+
+async def verify_repository_access(http: httpx.AsyncClient, repo_full_name: str, user_id: str) -> Dict:
     """Verify if user has access to the repository"""
-    token = get_github_token_for_user(user_id)
+    token = await get_github_token_for_user(user_id)
     
     if not token:
         return {
@@ -120,29 +623,30 @@ async def verify_repository_access(repo_full_name: str, user_id: str) -> Dict:
         }
     
     # Check repository access
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    headers = github_headers(token)
     
     try:
-        response = requests.get(f"https://api.github.com/repos/{repo_full_name}", headers=headers)
+        status_code, repo_data = await fetch_github_cached(
+            http,
+            ("repo", token_digest(token), repo_full_name),
+            f"https://api.github.com/repos/{repo_full_name}",
+            headers
+        )
         
-        if response.status_code == 200:
-            repo_data = response.json()
+        if status_code == 200:
             return {
                 "has_access": True,
                 "repository": repo_data,
                 "permissions": repo_data.get("permissions", {})
             }
-        elif response.status_code == 401:
+        elif status_code == 401:
             return {
                 "has_access": False,
                 "error": "invalid_token",
                 "message": "GitHub token is invalid or expired",
                 "auth_url": get_github_auth_url()
             }
-        elif response.status_code == 404:
+        elif status_code == 404:
             return {
                 "has_access": False,
                 "error": "repository_not_found",
@@ -152,7 +656,7 @@ async def verify_repository_access(repo_full_name: str, user_id: str) -> Dict:
             return {
                 "has_access": False,
                 "error": "api_error",
-                "message": f"GitHub API error: {response.status_code}"
+                "message": f"GitHub API error: {status_code}"
             }
     except Exception as e:
         return {
@@ -161,21 +665,77 @@ async def verify_repository_access(repo_full_name: str, user_id: str) -> Dict:
             "message": f"Failed to verify repository access: {str(e)}"
         }
 
-def get_github_auth_url() -> str:
-    """Generate GitHub OAuth URL"""
-    if GITHUB_CLIENT_ID == "your_github_client_id":
-        return ""
+async def fetch_repositories_graphql(http: httpx.AsyncClient, headers: Dict, page_size: int) -> tuple[int, Optional[List[Dict]]]:
+    """Fetch the viewer's repositories via GraphQL, following cursors past the first page.
+    Returns (status_code, None) when the query fails so callers can fall back to REST"""
+    repos = []
+    cursor = None
     
+    while True:
+        response = await http.post(
+            GITHUB_GRAPHQL_URL,
+            headers=headers,
+            json={"query": GITHUB_REPOSITORIES_QUERY, "variables": {"first": page_size, "after": cursor}}
+        )
+        if response.status_code != 200:
+            return response.status_code, None
+        
+        body = response.json()
+        if body.get("errors") or not body.get("data"):
+            return response.status_code, None
+        
+        connection = body["data"]["viewer"]["repositories"]
+        repos.extend(format_graphql_repository(node) for node in connection["nodes"])
+        
+        if not connection["pageInfo"]["hasNextPage"]:
+            return 200, repos
+        cursor = connection["pageInfo"]["endCursor"]
+
+async def fetch_repositories_rest(http: httpx.AsyncClient, headers: Dict, page_size: int) -> tuple[int, Optional[List[Dict]]]:
+    """Fetch the user's repositories via REST. The first page's Link header tells us
+    how many pages there are; the rest are fetched concurrently"""
+    url = "https://api.github.com/user/repos"
     params = {
-        "client_id": GITHUB_CLIENT_ID,
-        "redirect_uri": GITHUB_REDIRECT_URI,
-        "scope": "repo,read:user",
-        "state": "github_auth"
+        "per_page": page_size,
+        "sort": "updated",
+        "affiliation": "owner,collaborator,organization_member"
     }
     
-    return f"https://github.com/login/oauth/authorize?{urlencode(params)}"
+    response = await http.get(url, headers=headers, params={**params, "page": 1})
+    if response.status_code != 200:
+        return response.status_code, None
+    
+    responses = [response]
+    last_url = response.links.get("last", {}).get("url")
+    if last_url:
+        last_page = int(httpx.URL(last_url).params.get("page", "1"))
+        responses += await asyncio.gather(*[
+            http.get(url, headers=headers, params={**params, "page": page})
+            for page in range(2, last_page + 1)
+        ])
+    
+    formatted_repos = []
+    for response in responses:
+        if response.status_code != 200:
+            return response.status_code, None
+        
+        # Filter and format repository data
+        formatted_repos.extend(
+            dict(
+                zip(REST_REPOSITORY_FIELDS, get_rest_repository_fields(repo)),
+                permissions=repo.get("permissions") or EMPTY_PERMISSIONS,
+                topics=repo.get("topics") or EMPTY_TOPICS
+            )
+            for repo in response.json()
+        )
+    
+    return 200, formatted_repos
 
-async def exchange_github_code_for_token(code: str) -> Dict:
+def get_github_auth_url() -> str:
+    """Get GitHub OAuth URL, empty when OAuth is not configured"""
+    return GITHUB_AUTH_URL
+
+async def exchange_github_code_for_token(http: httpx.AsyncClient, code: str) -> Dict:
     """Exchange GitHub OAuth code for access token"""
     if GITHUB_CLIENT_ID == "your_github_client_id" or GITHUB_CLIENT_SECRET == "your_github_client_secret":
         raise HTTPException(
@@ -196,7 +756,7 @@ async def exchange_github_code_for_token(code: str) -> Dict:
     }
     
     try:
-        response = requests.post(
+        response = await http.post(
             "https://github.com/login/oauth/access_token",
             json=data,
             headers=headers
@@ -207,12 +767,7 @@ async def exchange_github_code_for_token(code: str) -> Dict:
             
             if "access_token" in result:
                 # Get user info
-                user_headers = {
-                    "Authorization": f"token {result['access_token']}",
-                    "Accept": "application/vnd.github.v3+json"
-                }
-                
-                user_response = requests.get("https://api.github.com/user", headers=user_headers)
+                user_response = await http.get("https://api.github.com/user", headers=github_headers(result["access_token"]))
                 user_data = user_response.json() if user_response.status_code == 200 else {}
                 
                 return {
@@ -239,65 +794,169 @@ async def exchange_github_code_for_token(code: str) -> Dict:
             "message": f"Failed to exchange code for token: {str(e)}"
         }
 
-def run_automation_task(repo_full_name: str, issue_number: int, repository_url: str, user_id: Optional[str] = None):
-    """Run automation task in background thread"""
+async def run_automation_task(
+    repo_full_name: str,
+    issue_number: int,
+    repository_url: str,
+    user_id: Optional[str] = None,
+    lease_token: Optional[str] = None,
+    priority: Priority = Priority.NORMAL
+):
+    """Run automation task for a newly opened issue"""
     if not PORTIA_AVAILABLE:
-        print(f"Portia not available, skipping automation for {repo_full_name}#{issue_number}")
+        logger.warning("Portia not available, skipping automation for %s#%s", repo_full_name, issue_number)
         return
         
     key = f"{repo_full_name}#{issue_number}"
+    started_at = datetime.now().isoformat()
+    
+    breaker = portia_breakers.setdefault(repo_full_name, CircuitBreaker())
     
     try:
+        if not breaker.allow():
+            await update_automation_status(repo_full_name, issue_number, {
+                "status": "failed",
+                "started_at": None,
+                "completed_at": datetime.now().isoformat(),
+                "error_message": "Automation paused for this repository after repeated failures. Please retry later.",
+                "task_id": None
+            })
+            logger.warning("Automation skipped for %s: circuit open", key)
+            return
+        
         # Update status to running
-        update_automation_status(repo_full_name, issue_number, {
+        await update_automation_status(repo_full_name, issue_number, {
             "status": "running",
-            "started_at": datetime.now().isoformat(),
+            "started_at": started_at,
             "completed_at": None,
             "error_message": None,
             "task_id": None
         })
         
         # Get GitHub token for repository access
-        github_token = get_github_token_for_user(user_id) if user_id else None
+        github_token = await get_github_token_for_user(user_id) if user_id else None
         
         # Prepare the task with authentication if available
-        task_description = f"give labels to this issue #{issue_number} from reading it title and body of github repository url: {repository_url}"
+        prompt = f"give labels to this issue #{issue_number} from reading it title and body of github repository url: {repository_url}"
+        task_description = prompt
         
         if github_token:
             task_description += f". Use this GitHub token for authentication: {github_token}"
         
-        # Run the automation task
-        plan_run = portia.run(task_description)
+        # Run the automation task off the event loop; the timeout covers the run, not queueing
+        plan_run = await dispatch_portia_task(task_description, priority, prompt)
+        
+        # Portia reports most failures as a FAILED run rather than by raising
+        if plan_run.state == PlanRunState.FAILED:
+            breaker.record_failure()
+            await update_automation_status(repo_full_name, issue_number, {
+                "status": "failed",
+                "started_at": started_at,
+                "completed_at": datetime.now().isoformat(),
+                "error_message": "Automation run failed. See the plan run for details.",
+                "task_id": str(plan_run.id)
+            })
+            logger.error("Automation failed for %s: plan run %s ended FAILED", key, plan_run.id)
+            return
+        breaker.record_success()
         
         # Update status to completed
-        update_automation_status(repo_full_name, issue_number, {
+        await update_automation_status(repo_full_name, issue_number, {
             "status": "completed",
-            "started_at": automation_status[key]["started_at"],
+            "started_at": started_at,
             "completed_at": datetime.now().isoformat(),
             "error_message": None,
             "task_id": plan_run.id if hasattr(plan_run, 'id') else None
         })
         
-        print(f"Automation completed for {key}")
+        logger.info("Automation completed for %s", key)
         if hasattr(plan_run, 'outputs'):
-            print(plan_run.outputs)
+            logger.debug("Automation outputs for %s: %s", key, plan_run.outputs)
             
+    except asyncio.CancelledError:
+        breaker.abandon_trial()
+        await update_automation_status(repo_full_name, issue_number, {
+            "status": "failed",
+            "started_at": started_at,
+            "completed_at": datetime.now().isoformat(),
+            "error_message": "Automation cancelled because the server shut down. Please retry.",
+            "task_id": None
+        })
+        raise
     except Exception as e:
+        breaker.record_failure()
         error_message = str(e)
         
+        if isinstance(e, TimeoutError):
+            error_message = f"Automation timed out after {PORTIA_TIMEOUT_SECONDS} seconds."
         # Check if it's an access-related error
-        if "403" in error_message or "401" in error_message or "access" in error_message.lower():
+        elif "403" in error_message or "401" in error_message or "access" in error_message.lower():
             error_message = "GitHub access denied. Please authenticate with GitHub to enable automation."
         
         # Update status to failed
-        update_automation_status(repo_full_name, issue_number, {
+        await update_automation_status(repo_full_name, issue_number, {
             "status": "failed",
-            "started_at": automation_status[key].get("started_at"),
+            "started_at": started_at,
             "completed_at": datetime.now().isoformat(),
             "error_message": error_message,
             "task_id": None
         })
-        print(f"Automation failed for {key}: {error_message}")
+        logger.error("Automation failed for %s: %s", key, error_message)
+    finally:
+        if lease_token is not None:
+            await state_store.release_automation_lease(repo_full_name, issue_number, lease_token)
+
+def run_automation_job(repo_full_name: str, issue_number: int, repository_url: str, user_id: Optional[str] = None, lease_token: Optional[str] = None):
+    """RQ entry point: run one automation in the worker's own event loop"""
+    async def job():
+        await state_store.connect()
+        try:
+            await run_automation_task(repo_full_name, issue_number, repository_url, user_id, lease_token)
+        finally:
+            await state_store.close()
+    
+    asyncio.run(job())
+
+def verify_webhook_signature(secret: str, body: bytes, signature_header: Optional[str]) -> bool:
+    """Check GitHub's X-Hub-Signature-256 header against the raw request body"""
+    if not signature_header:
+        return False
+    # hashlib.sha256 is OpenSSL-backed, so hashing large bodies stays cheap
+    mac = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"sha256={mac}", signature_header)
+
+async def enqueue_automation(
+    repo_full_name: str,
+    issue_number: int,
+    repository_url: str,
+    user_id: Optional[str] = None,
+    lease_token: Optional[str] = None,
+    priority: Priority = Priority.NORMAL
+) -> bool:
+    """Queue an automation job. Returns False when it could not be queued
+    (Redis unreachable, or too many local jobs in flight)"""
+    if automation_queue is not None:
+        # No RQ retry: run_automation_task records failures itself, and a rerun
+        # could label the issue twice; users retry through the retry endpoint
+        try:
+            await asyncio.to_thread(
+                automation_queue.enqueue,
+                run_automation_job,
+                repo_full_name, issue_number, repository_url, user_id, lease_token,
+                job_timeout=600
+            )
+        except RedisError:
+            logger.exception("Could not enqueue automation for %s#%s", repo_full_name, issue_number)
+            return False
+        return True
+    
+    if len(automation_tasks) >= AUTOMATION_MAX_PENDING:
+        return False
+    
+    task = asyncio.create_task(run_automation_task(repo_full_name, issue_number, repository_url, user_id, lease_token, priority))
+    automation_tasks.add(task)
+    task.add_done_callback(automation_tasks.discard)
+    return True
 
 @app.get("/")
 def read_root():
@@ -335,13 +994,13 @@ async def github_oauth_callback_get(code: str, state: Optional[str] = None):
     return RedirectResponse(url=frontend_url)
 
 @app.post("/auth/github/callback")
-async def github_oauth_callback_post(auth_request: GitHubAuthRequest):
+async def github_oauth_callback_post(request: Request, auth_request: GitHubAuthRequest):
     """Handle GitHub OAuth callback (POST from frontend)"""
-    result = await exchange_github_code_for_token(auth_request.code)
+    result = await exchange_github_code_for_token(request.app.state.gh_client, auth_request.code)
     
     if result["success"]:
         # Store the token for the user
-        set_github_token_for_user(auth_request.user_id, result["access_token"])
+        await set_github_token_for_user(auth_request.user_id, result["access_token"])
         
         return {
             "success": True,
@@ -355,21 +1014,22 @@ async def github_oauth_callback_post(auth_request: GitHubAuthRequest):
         )
 
 @app.get("/auth/github/status/{user_id}")
-def get_github_auth_status(user_id: str):
+async def get_github_auth_status(request: Request, user_id: str):
     """Check if user has GitHub authentication"""
-    token = get_github_token_for_user(user_id)
+    token = await get_github_token_for_user(user_id)
     
     if token:
         # Verify token is still valid
-        headers = {
-            "Authorization": f"token {token}",
-            "Accept": "application/vnd.github.v3+json"
-        }
+        headers = github_headers(token)
         
         try:
-            response = requests.get("https://api.github.com/user", headers=headers)
-            if response.status_code == 200:
-                user_data = response.json()
+            status_code, user_data = await fetch_github_cached(
+                request.app.state.gh_client,
+                ("user", token_digest(token)),
+                "https://api.github.com/user",
+                headers
+            )
+            if status_code == 200:
                 return {
                     "authenticated": True,
                     "user": {
@@ -380,7 +1040,7 @@ def get_github_auth_status(user_id: str):
                 }
             else:
                 # Token is invalid, remove it
-                github_tokens.pop(user_id, None)
+                await delete_github_token_for_user(user_id, token)
                 return {
                     "authenticated": False,
                     "auth_url": get_github_auth_url()
@@ -397,15 +1057,15 @@ def get_github_auth_status(user_id: str):
         }
 
 @app.post("/repository/access/verify")
-async def verify_repository_access_endpoint(access_request: RepositoryAccessRequest):
+async def verify_repository_access_endpoint(request: Request, access_request: RepositoryAccessRequest):
     """Verify if user has access to a repository"""
-    result = await verify_repository_access(access_request.repo_full_name, access_request.user_id)
+    result = await verify_repository_access(request.app.state.gh_client, access_request.repo_full_name, access_request.user_id)
     return result
 
 @app.get("/github/repositories/{user_id}")
-def get_user_github_repositories(user_id: str, per_page: int = 30, page: int = 1):
-    """Fetch user's GitHub repositories"""
-    token = get_github_token_for_user(user_id)
+async def get_user_github_repositories(request: Request, user_id: str, per_page: int = 100):
+    """Fetch all of the user's GitHub repositories, most recently updated first"""
+    token = await get_github_token_for_user(user_id)
     
     if not token:
         raise HTTPException(
@@ -413,64 +1073,34 @@ def get_user_github_repositories(user_id: str, per_page: int = 30, page: int = 1
             detail="GitHub authentication required"
         )
     
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    headers = github_headers(token)
+    page_size = max(1, min(per_page, 100))
+    http = request.app.state.gh_client
     
     try:
-        # Fetch user's repositories
-        response = requests.get(
-            f"https://api.github.com/user/repos",
-            headers=headers,
-            params={
-                "per_page": min(per_page, 100),
-                "page": page,
-                "sort": "updated",
-                "affiliation": "owner,collaborator,organization_member"
-            }
-        )
+        status_code, repos = await fetch_repositories_graphql(http, headers, page_size)
         
-        if response.status_code == 200:
-            repos = response.json()
-            
-            # Filter and format repository data
-            formatted_repos = []
-            for repo in repos:
-                formatted_repos.append({
-                    "id": repo["id"],
-                    "name": repo["name"],
-                    "full_name": repo["full_name"],
-                    "description": repo["description"],
-                    "html_url": repo["html_url"],
-                    "clone_url": repo["clone_url"],
-                    "private": repo["private"],
-                    "language": repo["language"],
-                    "stargazers_count": repo["stargazers_count"],
-                    "forks_count": repo["forks_count"],
-                    "open_issues_count": repo["open_issues_count"],
-                    "updated_at": repo["updated_at"],
-                    "permissions": repo.get("permissions", {}),
-                    "topics": repo.get("topics", [])
-                })
-            
+        # GraphQL can fail for reasons REST does not (e.g. SAML-protected orgs)
+        if repos is None and status_code != 401:
+            status_code, repos = await fetch_repositories_rest(http, headers, page_size)
+        
+        if repos is not None:
             return {
-                "repositories": formatted_repos,
-                "total_count": len(formatted_repos),
-                "page": page,
-                "per_page": per_page
+                "repositories": repos,
+                "total_count": len(repos),
+                "per_page": page_size
             }
-        elif response.status_code == 401:
+        elif status_code == 401:
             # Token is invalid
-            github_tokens.pop(user_id, None)
+            await delete_github_token_for_user(user_id, token)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="GitHub token expired or invalid"
             )
         else:
             raise HTTPException(
-                status_code=response.status_code,
-                detail=f"GitHub API error: {response.status_code}"
+                status_code=status_code,
+                detail=f"GitHub API error: {status_code}"
             )
             
     except Exception as e:
@@ -481,7 +1111,11 @@ def get_user_github_repositories(user_id: str, per_page: int = 30, page: int = 1
 
 # Repository Management Endpoints (Supabase)
 @app.post("/repositories")
-async def create_repository(user_id: str, repo_data: RepositoryCreateRequest):
+async def create_repository(
+    user_id: str,
+    repo_data: RepositoryCreateRequest,
+    supabase_repo: SupabaseRepository = Depends(get_supabase_repo)
+):
     """Add a repository to user's collection"""
     try:
         repository = await supabase_repo.add_repository(user_id, repo_data.dict())
@@ -489,8 +1123,9 @@ async def create_repository(user_id: str, repo_data: RepositoryCreateRequest):
     except Exception as e:
         if not supabase_repo.available:
             # Use in-memory storage as fallback
-            import uuid
             repo_id = str(uuid.uuid4())
+            # Kept as a datetime; it is only turned into a string when a response is rendered
+            now = datetime.now()
             repository = {
                 "id": repo_id,
                 "user_id": user_id,
@@ -498,24 +1133,24 @@ async def create_repository(user_id: str, repo_data: RepositoryCreateRequest):
                 "full_name": repo_data.full_name,
                 "description": repo_data.description,
                 "url": repo_data.url,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
+                "created_at": now,
+                "updated_at": now
             }
             
-            # Initialize user's repository list if not exists
-            if user_id not in in_memory_repositories:
-                in_memory_repositories[user_id] = []
+            # Initialize user's repository maps if not exists
+            user_repos = in_memory_repositories.setdefault(user_id, {})
+            user_repo_names = in_memory_repository_names.setdefault(user_id, {})
             
             # Check if repository already exists
-            existing = next((r for r in in_memory_repositories[user_id] if r["full_name"] == repo_data.full_name), None)
-            if existing:
+            if repo_data.full_name in user_repo_names:
                 raise HTTPException(
                     status_code=status.HTTP_409_CONFLICT,
                     detail="Repository already exists"
                 )
             
             # Add to in-memory storage
-            in_memory_repositories[user_id].append(repository)
+            user_repos[repo_id] = repository
+            user_repo_names[repo_data.full_name] = repo_id
             
             return {
                 "success": True, 
@@ -528,7 +1163,7 @@ async def create_repository(user_id: str, repo_data: RepositoryCreateRequest):
         )
 
 @app.get("/repositories/{user_id}")
-async def get_user_repositories(user_id: str):
+async def get_user_repositories(user_id: str, supabase_repo: SupabaseRepository = Depends(get_supabase_repo)):
     """Get user's repositories from Supabase"""
     try:
         repositories = await supabase_repo.get_repositories(user_id)
@@ -536,7 +1171,7 @@ async def get_user_repositories(user_id: str):
     except Exception as e:
         if not supabase_repo.available:
             # Use in-memory storage as fallback
-            user_repos = in_memory_repositories.get(user_id, [])
+            user_repos = list(in_memory_repositories.get(user_id, {}).values())
             return {
                 "repositories": user_repos,
                 "note": f"Using in-memory storage ({len(user_repos)} repositories found)"
@@ -547,7 +1182,11 @@ async def get_user_repositories(user_id: str):
         )
 
 @app.delete("/repositories/{repository_id}")
-async def delete_repository(repository_id: str, user_id: str):
+async def delete_repository(
+    repository_id: str,
+    user_id: str,
+    supabase_repo: SupabaseRepository = Depends(get_supabase_repo)
+):
     """Delete a repository"""
     try:
         success = await supabase_repo.delete_repository(repository_id, user_id)
@@ -561,15 +1200,14 @@ async def delete_repository(repository_id: str, user_id: str):
     except Exception as e:
         if not supabase_repo.available:
             # Use in-memory storage as fallback
-            if user_id in in_memory_repositories:
-                user_repos = in_memory_repositories[user_id]
-                repo_to_delete = next((r for r in user_repos if r["id"] == repository_id), None)
-                if repo_to_delete:
-                    user_repos.remove(repo_to_delete)
-                    return {
-                        "success": True,
-                        "message": "Repository deleted successfully (in-memory mode)"
-                    }
+            user_repos = in_memory_repositories.get(user_id, {})
+            repo_to_delete = user_repos.pop(repository_id, None)
+            if repo_to_delete:
+                in_memory_repository_names[user_id].pop(repo_to_delete["full_name"], None)
+                return {
+                    "success": True,
+                    "message": "Repository deleted successfully (in-memory mode)"
+                }
             
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -581,10 +1219,10 @@ async def delete_repository(repository_id: str, user_id: str):
         )
 
 @app.post("/github/webhook/{user_id}")
-def setup_github_webhook(user_id: str, request: WebhookSetupRequest):
+async def setup_github_webhook(request: Request, user_id: str, webhook_request: WebhookSetupRequest):
     """Set up GitHub webhook for a repository"""
-    repo_full_name = request.repo_full_name
-    token = get_github_token_for_user(user_id)
+    repo_full_name = webhook_request.repo_full_name
+    token = await get_github_token_for_user(user_id)
     
     if not token:
         raise HTTPException(
@@ -593,7 +1231,6 @@ def setup_github_webhook(user_id: str, request: WebhookSetupRequest):
         )
     
     # Generate a webhook secret
-    import secrets
     webhook_secret = secrets.token_urlsafe(32)
     
     # Webhook configuration
@@ -614,15 +1251,11 @@ def setup_github_webhook(user_id: str, request: WebhookSetupRequest):
         }
     }
     
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json",
-        "Content-Type": "application/json"
-    }
+    headers = github_headers(token)
     
     try:
         # Create webhook
-        response = requests.post(
+        response = await request.app.state.gh_client.post(
             f"https://api.github.com/repos/{repo_full_name}/hooks",
             headers=headers,
             json=webhook_config
@@ -631,8 +1264,12 @@ def setup_github_webhook(user_id: str, request: WebhookSetupRequest):
         if response.status_code == 201:
             webhook_data = response.json()
             
-            # Store webhook secret
-            webhook_secrets[repo_full_name] = webhook_secret
+            # Store webhook secret and remember the webhook for status polling
+            await state_store.set_webhook_secret(repo_full_name, webhook_secret)
+            await state_store.set_webhook_info(
+                repo_full_name,
+                webhook_registry_entry(webhook_data, response.headers.get("etag"), [user_id])
+            )
             
             return {
                 "success": True,
@@ -667,13 +1304,63 @@ def setup_github_webhook(user_id: str, request: WebhookSetupRequest):
             detail=f"Failed to create webhook: {str(e)}"
         )
 
+def webhook_registry_entry(webhook: Dict, etag: Optional[str] = None, authorized_users: List[str] = ()) -> Dict:
+    """Fields of a GitHub webhook that get_webhook_status reports
+
+    authorized_users are the users whose token GitHub has let read the
+    repository's hooks; only they are answered from the registry.
+    """
+    return {
+        "id": webhook["id"],
+        "url": webhook["config"]["url"],
+        "events": webhook["events"],
+        "active": webhook.get("active", True),
+        "last_response": webhook.get("last_response"),
+        "etag": etag,
+        "authorized_users": sorted(set(authorized_users)),
+        "refreshed_at": time.time()
+    }
+
+async def refresh_webhook_info(http: httpx.AsyncClient, repo_full_name: str, user_id: str, headers: Dict, webhook: Dict):
+    """Revalidate a registered webhook with a conditional request"""
+    if webhook["etag"]:
+        headers = {**headers, "If-None-Match": webhook["etag"]}
+    
+    try:
+        response = await http.get(f"https://api.github.com/repos/{repo_full_name}/hooks/{webhook['id']}", headers=headers)
+    except httpx.HTTPError as e:
+        logger.warning("Failed to refresh webhook for %s: %s", repo_full_name, e)
+        return
+    
+    if response.status_code == 304:
+        await state_store.set_webhook_info(repo_full_name, {**webhook, "refreshed_at": time.time()})
+    elif response.status_code == 200:
+        await state_store.set_webhook_info(
+            repo_full_name,
+            webhook_registry_entry(response.json(), response.headers.get("etag"), webhook["authorized_users"])
+        )
+    elif response.status_code in (403, 404):
+        # GitHub answers 404 both when the hook is gone and when the token lost
+        # admin rights; only an admin token proves the hook was deleted
+        access = await verify_repository_access(http, repo_full_name, user_id)
+        if response.status_code == 404 and access["has_access"] and access["permissions"].get("admin"):
+            await state_store.delete_webhook_info(repo_full_name)
+        else:
+            authorized_users = [user for user in webhook["authorized_users"] if user != user_id]
+            await state_store.set_webhook_info(repo_full_name, {**webhook, "authorized_users": authorized_users})
+
 @app.get("/github/webhook/status/{user_id}")
-def get_webhook_status(user_id: str, repo_full_name: Optional[str] = None):
+async def get_webhook_status(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user_id: str,
+    repo_full_name: Optional[str] = None
+):
     """Get webhook status for a GitHub repository."""
     if not repo_full_name:
         raise HTTPException(status_code=400, detail="repo_full_name query parameter required")
         
-    token = get_github_token_for_user(user_id)
+    token = await get_github_token_for_user(user_id)
     
     if not token:
         raise HTTPException(
@@ -681,14 +1368,26 @@ def get_webhook_status(user_id: str, repo_full_name: Optional[str] = None):
             detail="GitHub authentication required"
         )
     
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    headers = github_headers(token)
+    
+    # Answer from the registry only for users GitHub already let read the hooks;
+    # revalidate with GitHub after responding when stale
+    registered = await state_store.get_webhook_info(repo_full_name)
+    if registered and user_id in registered.get("authorized_users", ()):
+        if time.time() - registered["refreshed_at"] > WEBHOOK_REFRESH_SECONDS:
+            background_tasks.add_task(refresh_webhook_info, request.app.state.gh_client, repo_full_name, user_id, headers, registered)
+        return {
+            "configured": True,
+            "webhook_url": registered["url"],
+            "events": registered["events"],
+            "active": registered["active"],
+            "webhook_id": registered["id"],
+            "last_response": registered["last_response"]
+        }
     
     try:
         # Get existing webhooks
-        response = requests.get(
+        response = await request.app.state.gh_client.get(
             f"https://api.github.com/repos/{repo_full_name}/hooks",
             headers=headers
         )
@@ -706,6 +1405,11 @@ def get_webhook_status(user_id: str, repo_full_name: Optional[str] = None):
                     break
             
             if our_webhook:
+                authorized_users = registered.get("authorized_users", []) if registered else []
+                await state_store.set_webhook_info(
+                    repo_full_name,
+                    webhook_registry_entry(our_webhook, authorized_users=[*authorized_users, user_id])
+                )
                 return {
                     "configured": True,
                     "webhook_url": our_webhook["config"]["url"],
@@ -729,25 +1433,98 @@ def get_webhook_status(user_id: str, repo_full_name: Optional[str] = None):
             detail=f"Failed to get webhook status: {str(e)}"
         )
 
-@app.post("/github-webhook")
-def handle_github_webhook(payload: dict):
+@app.post("/github-webhook", status_code=status.HTTP_202_ACCEPTED)
+async def handle_github_webhook(
+    request: Request,
+    x_github_event: str = Header(...),
+    x_hub_signature_256: Optional[str] = Header(None)
+):
     """Handle GitHub webhook events"""
-    print("GitHub webhook received")
+    logger.debug("GitHub webhook received")
+    
+    # Only newly opened issues trigger automation; ignore everything else
+    # (comments, pull requests, edits, labels...) before doing any parsing
+    if x_github_event != "issues":
+        return {"ok": True}
+    
+    body = await request.body()
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Webhook body is not valid JSON"
+        )
+    if not isinstance(data, dict):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Webhook body must be a JSON object"
+        )
+    if data.get("action") != "opened":
+        return {"ok": True}
+    
+    try:
+        payload = IssueWebhookPayload.model_validate(data)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=e.errors(include_url=False, include_context=False)
+        )
 
-    if payload.get("action") == "opened" and "issue" in payload:
-        issue = payload["issue"]
-        repository = payload["repository"]
-        repo_full_name = repository["full_name"]
-        issue_number = issue["number"]
-        repository_url = issue["repository_url"]
+    if payload.issue and payload.repository:
+        issue = payload.issue
+        repository = payload.repository
+        repo_full_name = repository.full_name
+        issue_number = issue.number
+        repository_url = issue.repository_url
+        
+        # The automation acts on repository_url with the owner's token, so every
+        # repository field must name the repository the signature is checked for
+        repo_owner = repo_full_name.split("/", 1)[0]
+        owner_login = repository.owner.login if repository.owner else None
+        if (
+            "/" not in repo_full_name
+            or (owner_login is not None and owner_login.lower() != repo_owner.lower())
+            or repository_url.lower() != f"https://api.github.com/repos/{repo_full_name}".lower()
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Webhook repository fields do not match"
+            )
+        
+        # Webhooks created through setup_github_webhook have a secret and must be signed.
+        # Unsigned deliveries are only accepted for owners with no secret at all
+        # (manually configured webhooks), so a payload cannot dodge the check by
+        # naming a repository that has none
+        webhook_secret = await state_store.get_webhook_secret(repo_full_name)
+        if webhook_secret and not verify_webhook_signature(webhook_secret, body, x_hub_signature_256):
+            # The cached secret may predate a rotation on another worker
+            webhook_secret = await state_store.get_webhook_secret(repo_full_name, refresh=True)
+        if webhook_secret:
+            if not verify_webhook_signature(webhook_secret, body, x_hub_signature_256):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid webhook signature"
+                )
+        elif await state_store.owner_has_webhook_secret(repo_owner):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Webhook signature required"
+            )
         
         # Try to find user_id from repository owner (this is a simplification)
         # In production, you'd want to map repository to user_id properly
-        repo_owner = repository.get("owner", {}).get("login")
         user_id = repo_owner  # Simplified mapping
         
+        # GitHub redeliveries must not restart an automation that is already in flight
+        lease_token = None
+        if PORTIA_AVAILABLE:
+            lease_token = await state_store.acquire_automation_lease(repo_full_name, issue_number)
+            if lease_token is None:
+                return {"ok": True, "deduped": True}
+        
         # Initialize status as pending
-        update_automation_status(repo_full_name, issue_number, {
+        await update_automation_status(repo_full_name, issue_number, {
             "status": "pending",
             "started_at": None,
             "completed_at": None,
@@ -755,33 +1532,38 @@ def handle_github_webhook(payload: dict):
             "task_id": None
         })
         
-        # Start automation in background thread only if Portia is available
+        # Queue automation only if Portia is available
         if PORTIA_AVAILABLE:
-            thread = threading.Thread(
-                target=run_automation_task, 
-                args=(repo_full_name, issue_number, repository_url, user_id)
-            )
-            thread.daemon = True
-            thread.start()
+            if not await enqueue_automation(repo_full_name, issue_number, repository_url, user_id, lease_token):
+                await state_store.release_automation_lease(repo_full_name, issue_number, lease_token)
+                await update_automation_status(repo_full_name, issue_number, {
+                    "status": "failed",
+                    "started_at": None,
+                    "completed_at": datetime.now().isoformat(),
+                    "error_message": "Automation could not be queued. Please retry later.",
+                    "task_id": None
+                })
+                return {
+                    "message": "GitHub webhook received (automation could not be queued)",
+                    "automation_status": "failed"
+                }
             
             return {
                 "message": "GitHub webhook received", 
-                "automation_status": "pending",
-                "payload": payload
+                "automation_status": "pending"
             }
         else:
             return {
-                "message": "GitHub webhook received (automation disabled - Portia not available)", 
-                "payload": payload
+                "message": "GitHub webhook received (automation disabled - Portia not available)"
             }
     else:
-        return {"message": "GitHub webhook received", "payload": payload}
+        return {"ok": True}
 
 @app.get("/automation-status/{repo_owner}/{repo_name}/{issue_number}")
-def get_issue_automation_status(repo_owner: str, repo_name: str, issue_number: int):
+async def get_issue_automation_status(repo_owner: str, repo_name: str, issue_number: int):
     """Get automation status for a specific issue"""
     repo_full_name = f"{repo_owner}/{repo_name}"
-    status = get_automation_status(repo_full_name, issue_number)
+    status = await get_automation_status(repo_full_name, issue_number)
     
     if status:
         return {"automation_status": status}
@@ -789,20 +1571,15 @@ def get_issue_automation_status(repo_owner: str, repo_name: str, issue_number: i
         return {"automation_status": None}
 
 @app.get("/automation-status/{repo_owner}/{repo_name}")
-def get_repository_automation_status(repo_owner: str, repo_name: str):
+async def get_repository_automation_status(repo_owner: str, repo_name: str):
     """Get automation status for all issues in a repository"""
     repo_full_name = f"{repo_owner}/{repo_name}"
-    repo_statuses = {}
-    
-    for key, status in automation_status.items():
-        if key.startswith(f"{repo_full_name}#"):
-            issue_number = key.split("#")[1]
-            repo_statuses[issue_number] = status
+    repo_statuses = await state_store.get_repository_automation_statuses(repo_full_name)
     
     return {"automation_statuses": repo_statuses}
 
 @app.post("/automation-status/{repo_owner}/{repo_name}/{issue_number}/retry")
-def retry_automation(repo_owner: str, repo_name: str, issue_number: int, user_id: Optional[str] = None):
+async def retry_automation(repo_owner: str, repo_name: str, issue_number: int, user_id: Optional[str] = None):
     """Retry automation for a specific issue"""
     if not PORTIA_AVAILABLE:
         raise HTTPException(
@@ -812,8 +1589,15 @@ def retry_automation(repo_owner: str, repo_name: str, issue_number: int, user_id
         
     repo_full_name = f"{repo_owner}/{repo_name}"
     
+    lease_token = await state_store.acquire_automation_lease(repo_full_name, issue_number)
+    if lease_token is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Automation is already running for this issue"
+        )
+    
     # Reset status to pending
-    update_automation_status(repo_full_name, issue_number, {
+    await update_automation_status(repo_full_name, issue_number, {
         "status": "pending",
         "started_at": None,
         "completed_at": None,
@@ -821,57 +1605,109 @@ def retry_automation(repo_owner: str, repo_name: str, issue_number: int, user_id
         "task_id": None
     })
     
-    # Start automation in background thread
+    # Queue automation on the bounded worker pool
     repository_url = f"https://api.github.com/repos/{repo_full_name}"
-    thread = threading.Thread(
-        target=run_automation_task, 
-        args=(repo_full_name, issue_number, repository_url, user_id)
-    )
-    thread.daemon = True
-    thread.start()
+    if not await enqueue_automation(repo_full_name, issue_number, repository_url, user_id, lease_token, Priority.LOW):
+        await state_store.release_automation_lease(repo_full_name, issue_number, lease_token)
+        await update_automation_status(repo_full_name, issue_number, {
+            "status": "failed",
+            "started_at": None,
+            "completed_at": datetime.now().isoformat(),
+            "error_message": "Automation could not be queued. Please retry later.",
+            "task_id": None
+        })
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Automation could not be queued. Please retry later."
+        )
     
     return {"message": "Automation retry initiated", "status": "pending"}
 
 # Portia task endpoints (only available if Portia is configured)
+async def run_portia(task: str):
+    """Run a Portia task through the batcher, shedding load once the queue backs up"""
+    # portia_slots is the only concurrency limit; reject instead of queueing once a
+    # full executor's worth of interactive tasks is already waiting for a slot
+    waiting = sum(batcher.waiting[Priority.HIGH] for batcher in portia_batchers.values())
+    if waiting >= PORTIA_MAX_IN_FLIGHT:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many tasks running, try again later",
+            headers={"Retry-After": "5"}
+        )
+    
+    try:
+        return await dispatch_portia_task(task, Priority.HIGH)
+    except TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Task did not finish within {PORTIA_TIMEOUT_SECONDS} seconds"
+        )
+
 @app.get("/run-task")
-def run_task():
+async def run_task():
     """Run default Portia task"""
     if not PORTIA_AVAILABLE:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Portia not available"
         )
-    plan_run = portia.run(task0)
-    return {"message": "Task is running", "task_id": plan_run.id}
+    plan_run = await run_portia(task0)
+    return {"message": "Task is running", "task_id": str(plan_run.id)}
 
 @app.post("/run-task")
-def run_task_post(request: TaskRequest):
+async def run_task_post(request: TaskRequest):
     """Run custom Portia task"""
     if not PORTIA_AVAILABLE:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Portia not available"
         )
-        
-    if not request.task or request.task.strip() == "":
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Task cannot be empty"
-        )
     
-    print("Received task:", request.task)
-    plan_run = portia.run(request.task)
-    return {"message": "Task is running", "task_id": plan_run}
+    cache_key = task_cache_key(request.task)
+    cached_task_id = task_cache.get(cache_key)
+    if cached_task_id is not None:
+        return {"message": "Task is running", "task_id": cached_task_id, "cached": True}
+    
+    run = task_runs_in_flight.get(cache_key)
+    shared = run is not None
+    if run is None:
+        logger.info("Received task: %s", request.task)
+        run = asyncio.create_task(run_portia(request.task))
+        task_runs_in_flight[cache_key] = run
+        run.add_done_callback(lambda finished: finish_task_run(cache_key, finished))
+    
+    # Shielded so one client disconnecting does not cancel the run for the others
+    plan_run = await asyncio.shield(run)
+    return {"message": "Task is running", "task_id": str(plan_run.id), "cached": shared}
+
+@app.get("/debug/batch_stats")
+async def debug_batch_stats():
+    """Debug endpoint to check how /run-task calls are being batched"""
+    return {bucket: batcher.stats() for bucket, batcher in portia_batchers.items()}
 
 @app.get("/debug/tokens")
-def debug_tokens():
+async def debug_tokens():
     """Debug endpoint to check stored tokens"""
     return {
-        "stored_tokens": list(github_tokens.keys()),
-        "webhook_secrets": list(webhook_secrets.keys()),
+        "stored_tokens": await state_store.count_github_tokens(),
+        "webhook_secrets": await state_store.count_webhook_secrets(),
         "portia_available": PORTIA_AVAILABLE
     }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Without Redis every worker would hold its own tokens, secrets and statuses,
+    # and without Supabase its own in-memory repositories. The task cache,
+    # circuit breakers and PORTIA_MAX_IN_FLIGHT stay per worker regardless.
+    shared_state = bool(REDIS_URL and SUPABASE_URL and SUPABASE_KEY)
+    workers = int(os.getenv("UVICORN_WORKERS", os.cpu_count() or 1)) if shared_state else 1
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning"
+    )
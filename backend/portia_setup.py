@@ -12,6 +12,7 @@ from portia import (
     LLMProvider,
     GenerativeModel,
     Message,
+    PlanRunState,
     open_source_tool_registry,
 )
 from portia.cli import CLIExecutionHooks
@@ -42,10 +43,55 @@ my_config = Config.from_default(
     planning_model="google/gemini-2.5-flash"
 )
 
+# Cheaper tier for short issue-labelling tasks
+lite_config = Config.from_default(
+    storage_class=StorageClass.CLOUD,
+    llm_provider=LLMProvider.GOOGLE,
+    google_api_key=GOOGLE_API_KEY,
+    default_model="google/gemini-2.5-flash-lite",
+    planning_model="google/gemini-2.5-flash-lite"
+)
+
+# Prompts shorter than this (in practice the issue-labelling template) count as
+# "short": main.py batches them separately and they may use the lite tier
+SHORT_TASK_MAX_LENGTH = 300
+
+# Process-wide singletons, one per model tier: every caller must go through
+# these instances rather than build a new Portia, so the model clients and
+# their open connections are reused. There is deliberately no startup warm-up:
+# Portia does not expose the HTTP clients these instances build, and warming
+# them through portia.run would cost a billed plan run per worker on every start.
 portia = Portia(
     config=my_config,
     tools=DefaultToolRegistry(my_config) ,
     execution_hooks=CLIExecutionHooks(),
 )
 
+portia_lite = Portia(
+    config=lite_config,
+    tools=DefaultToolRegistry(lite_config) ,
+    execution_hooks=CLIExecutionHooks(),
+)
+
+
+def is_short_task(prompt: str) -> bool:
+    return len(prompt) < SHORT_TASK_MAX_LENGTH
+
+
+def use_lite_model(prompt: str) -> bool:
+    return is_short_task(prompt) and prompt.lower().startswith("give labels")
+
+
+def run_task(task: str, use_lite: bool = False):
+    """Run a task on the lite tier when the caller's routing allows it
+
+    A failed lite run is retried on the full model only if it failed before
+    any step produced output; once a tool step has run (e.g. labels were
+    applied) a rerun could repeat its side effects, so the failure is returned.
+    """
+    if use_lite:
+        plan_run = portia_lite.run(task)
+        if plan_run.state != PlanRunState.FAILED or plan_run.outputs.step_outputs:
+            return plan_run
+    return portia.run(task)
 
@@ -0,0 +1,301 @@
+import os
+import time
+import uuid
+import orjson
+from cachetools import TTLCache
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Redis configuration
+REDIS_URL = os.getenv("REDIS_URL", "")
+
+REDIS_MAX_CONNECTIONS = 20
+# Per-worker read-through cache for tokens and secrets, so webhooks skip Redis
+LOCAL_CACHE_TTL_SECONDS = 60
+AUTOMATION_TTL_SECONDS = 7 * 86400  # 7 days
+AUTOMATION_LEASE_SECONDS = 600  # matches the RQ job timeout
+
+# Delete the lease only if it still belongs to the caller; a run that outlived
+# its lease must not release the one a newer run acquired
+RELEASE_LEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Delete a user's token only if it is still the one the caller found invalid;
+# a token re-authorised in the meantime must survive
+DELETE_TOKEN_SCRIPT = """
+if redis.call("HGET", KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call("HDEL", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+AUTOMATION_FIELDS = ("status", "started_at", "completed_at", "error_message", "task_id")
+
+# Hashes of user_id -> token and repo_full_name -> secret
+TOKENS_KEY = "gh:tokens"
+WEBHOOK_SECRETS_KEY = "gh:webhook_secrets"
+# Set of repository owners (lowercased) with at least one webhook secret
+WEBHOOK_OWNERS_KEY = "gh:webhook_owners"
+
+def repository_owner(repo_full_name: str) -> str:
+    return repo_full_name.split("/", 1)[0].lower()
+
+def webhook_info_key(repo_full_name: str) -> str:
+    return f"gh:hook:{repo_full_name}"
+
+def automation_key(repo_full_name: str, issue_number: int) -> str:
+    return f"auto:{repo_full_name}#{issue_number}"
+
+def automation_lease_key(repo_full_name: str, issue_number: int) -> str:
+    return f"auto:lease:{repo_full_name}#{issue_number}"
+
+def automation_index_key(repo_full_name: str) -> str:
+    """Per-repository set of issue numbers that have an automation status"""
+    return f"auto:idx:{repo_full_name}"
+
+def encode_automation_status(status_data: Dict) -> Dict[str, str]:
+    """Drop empty fields, Redis hashes cannot hold None"""
+    return {field: str(status_data[field]) for field in AUTOMATION_FIELDS if status_data.get(field) is not None}
+
+def decode_automation_status(raw: Dict[str, str]) -> Optional[Dict]:
+    if not raw:
+        return None
+    return {field: raw.get(field) for field in AUTOMATION_FIELDS}
+
+class StateStore:
+    """Shared store for GitHub tokens, webhook secrets and automation status
+
+    Backed by Redis when REDIS_URL is configured so all uvicorn workers and
+    RQ automation workers see the same state. Falls back to process memory.
+    """
+
+    def __init__(self):
+        self.available = REDIS_AVAILABLE and bool(REDIS_URL)
+        self.redis = None  # created in connect()
+        self.release_lease_script = None
+        self.delete_token_script = None
+
+        # In-memory fallback when Redis is not configured
+        self.automation_status: Dict[str, Dict] = {}  # "repo#issue" -> status
+        # Secondary index so per-repository lookups skip other repositories
+        self.automation_status_by_repo: Dict[str, Dict[str, Dict]] = {}  # repo -> issue -> status
+        # Tokens and secrets are only written from request handlers; automations just read
+        self.github_tokens: Dict[str, str] = {}  # user_id -> github_token
+        self.webhook_secrets: Dict[str, str] = {}  # repo_full_name -> webhook_secret
+        self.webhook_owners: Set[str] = set()  # owners with any webhook secret
+        self.webhook_registry: Dict[str, Dict] = {}  # repo_full_name -> webhook info
+        self.automation_leases: Dict[str, Tuple[str, float]] = {}  # "repo#issue" -> (owner token, expiry (monotonic))
+
+        # Only used with Redis; a token or secret changed on another worker stays visible
+        # here for up to the TTL, so callers drop the entry when it stops working
+        self.token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=LOCAL_CACHE_TTL_SECONDS)
+        self.webhook_secret_cache: TTLCache = TTLCache(maxsize=10_000, ttl=LOCAL_CACHE_TTL_SECONDS)
+
+    async def connect(self):
+        """Create the async Redis connection pool"""
+        if self.available:
+            self.redis = aioredis.Redis.from_url(
+                REDIS_URL, decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS
+            )
+            self.release_lease_script = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+            self.delete_token_script = self.redis.register_script(DELETE_TOKEN_SCRIPT)
+            # Secrets stored before the owner index existed still need their owner recorded
+            owners = {repository_owner(repo) for repo in await self.redis.hkeys(WEBHOOK_SECRETS_KEY)}
+            if owners:
+                await self.redis.sadd(WEBHOOK_OWNERS_KEY, *owners)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    # GitHub tokens
+
+    async def get_github_token(self, user_id: str) -> Optional[str]:
+        if not self.available:
+            return self.github_tokens.get(user_id)
+        token = self.token_cache.get(user_id)
+        if token is None:
+            token = await self.redis.hget(TOKENS_KEY, user_id)
+            if token is not None:
+                self.token_cache[user_id] = token
+        return token
+
+    async def set_github_token(self, user_id: str, token: str):
+        if not self.available:
+            self.github_tokens[user_id] = token
+            return
+        await self.redis.hset(TOKENS_KEY, user_id, token)
+        self.token_cache[user_id] = token
+
+    async def delete_github_token(self, user_id: str, token: str):
+        """Remove a token that GitHub rejected, unless the user has stored a new one since"""
+        if not self.available:
+            if self.github_tokens.get(user_id) == token:
+                del self.github_tokens[user_id]
+            return
+        # Drop the local copy either way; it may be the stale one
+        self.token_cache.pop(user_id, None)
+        await self.delete_token_script(keys=[TOKENS_KEY], args=[user_id, token])
+
+    async def count_github_tokens(self) -> int:
+        if not self.available:
+            return len(self.github_tokens)
+        return await self.redis.hlen(TOKENS_KEY)
+
+    # Webhook secrets
+
+    async def get_webhook_secret(self, repo_full_name: str, refresh: bool = False) -> Optional[str]:
+        """Read a webhook secret; `refresh` skips the local cache, e.g. after a signature mismatch"""
+        if not self.available:
+            return self.webhook_secrets.get(repo_full_name)
+        if refresh:
+            self.webhook_secret_cache.pop(repo_full_name, None)
+        secret = self.webhook_secret_cache.get(repo_full_name)
+        if secret is None:
+            secret = await self.redis.hget(WEBHOOK_SECRETS_KEY, repo_full_name)
+            if secret is not None:
+                self.webhook_secret_cache[repo_full_name] = secret
+        return secret
+
+    async def set_webhook_secret(self, repo_full_name: str, secret: str):
+        if not self.available:
+            self.webhook_secrets[repo_full_name] = secret
+            self.webhook_owners.add(repository_owner(repo_full_name))
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(WEBHOOK_SECRETS_KEY, repo_full_name, secret)
+            pipe.sadd(WEBHOOK_OWNERS_KEY, repository_owner(repo_full_name))
+            await pipe.execute()
+        self.webhook_secret_cache[repo_full_name] = secret
+
+    async def owner_has_webhook_secret(self, owner: str) -> bool:
+        """Whether any repository of this owner has a webhook secret, i.e. its deliveries must be signed"""
+        if not self.available:
+            return owner.lower() in self.webhook_owners
+        return bool(await self.redis.sismember(WEBHOOK_OWNERS_KEY, owner.lower()))
+
+    async def count_webhook_secrets(self) -> int:
+        if not self.available:
+            return len(self.webhook_secrets)
+        return await self.redis.hlen(WEBHOOK_SECRETS_KEY)
+
+    # Webhook registry
+
+    async def get_webhook_info(self, repo_full_name: str) -> Optional[Dict]:
+        if not self.available:
+            return self.webhook_registry.get(repo_full_name)
+        raw = await self.redis.get(webhook_info_key(repo_full_name))
+        return orjson.loads(raw) if raw else None
+
+    async def set_webhook_info(self, repo_full_name: str, info: Dict):
+        if not self.available:
+            self.webhook_registry[repo_full_name] = info
+            return
+        await self.redis.set(webhook_info_key(repo_full_name), orjson.dumps(info))
+
+    async def delete_webhook_info(self, repo_full_name: str):
+        if not self.available:
+            self.webhook_registry.pop(repo_full_name, None)
+            return
+        await self.redis.delete(webhook_info_key(repo_full_name))
+
+    # Automation status
+
+    async def get_automation_status(self, repo_full_name: str, issue_number: int) -> Optional[Dict]:
+        if not self.available:
+            return self.automation_status.get(f"{repo_full_name}#{issue_number}")
+        raw = await self.redis.hgetall(automation_key(repo_full_name, issue_number))
+        return decode_automation_status(raw)
+
+    async def set_automation_status(self, repo_full_name: str, issue_number: int, status_data: Dict):
+        if not self.available:
+            self.automation_status[f"{repo_full_name}#{issue_number}"] = status_data
+            self.automation_status_by_repo.setdefault(repo_full_name, {})[str(issue_number)] = status_data
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._queue_automation_write(pipe, repo_full_name, issue_number, status_data)
+            await pipe.execute()
+
+    def _queue_automation_write(self, pipe, repo_full_name: str, issue_number: int, status_data: Dict):
+        """Replace the status hash and refresh the repository index"""
+        key = automation_key(repo_full_name, issue_number)
+        index_key = automation_index_key(repo_full_name)
+        pipe.delete(key)
+        pipe.hset(key, mapping=encode_automation_status(status_data))
+        pipe.expire(key, AUTOMATION_TTL_SECONDS)
+        pipe.sadd(index_key, issue_number)
+        pipe.expire(index_key, AUTOMATION_TTL_SECONDS)
+
+    async def acquire_automation_lease(self, repo_full_name: str, issue_number: int) -> Optional[str]:
+        """Claim an issue for one automation run
+
+        Returns the owner token to release the lease with, or None if another
+        run holds it.
+        """
+        token = uuid.uuid4().hex
+        if not self.available:
+            key = f"{repo_full_name}#{issue_number}"
+            now = time.monotonic()
+            # No await between check and set, so this is atomic on the event loop
+            lease = self.automation_leases.get(key)
+            if lease is not None and lease[1] > now:
+                return None
+            self.automation_leases[key] = (token, now + AUTOMATION_LEASE_SECONDS)
+            return token
+        acquired = await self.redis.set(
+            automation_lease_key(repo_full_name, issue_number), token,
+            nx=True, ex=AUTOMATION_LEASE_SECONDS
+        )
+        return token if acquired else None
+
+    async def release_automation_lease(self, repo_full_name: str, issue_number: int, token: str):
+        """Release a lease, unless it has expired and been taken by another run"""
+        if not self.available:
+            key = f"{repo_full_name}#{issue_number}"
+            lease = self.automation_leases.get(key)
+            if lease is not None and lease[0] == token:
+                del self.automation_leases[key]
+            return
+        await self.release_lease_script(keys=[automation_lease_key(repo_full_name, issue_number)], args=[token])
+
+    async def get_repository_automation_statuses(self, repo_full_name: str) -> Dict[str, Dict]:
+        """Get automation statuses for every tracked issue in a repository"""
+        if not self.available:
+            # Copy so later writes do not change a response being serialized
+            return dict(self.automation_status_by_repo.get(repo_full_name, {}))
+
+        index_key = automation_index_key(repo_full_name)
+        issue_numbers = list(await self.redis.smembers(index_key))
+        if not issue_numbers:
+            return {}
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for issue_number in issue_numbers:
+                pipe.hgetall(automation_key(repo_full_name, issue_number))
+            results = await pipe.execute()
+
+        repo_statuses = {}
+        expired = []
+        for issue_number, raw in zip(issue_numbers, results):
+            status = decode_automation_status(raw)
+            if status is None:
+                expired.append(issue_number)
+            else:
+                repo_statuses[issue_number] = status
+
+        if expired:
+            await self.redis.srem(index_key, *expired)
+        return repo_statuses
+
+# Global instance
+state_store = StateStore()
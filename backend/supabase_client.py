@@ -1,88 +1,243 @@
 import os
-from supabase import create_client, Client
-from typing import Optional, Dict, List
-import uuid
-from datetime import datetime
+import asyncio
+import logging
+from functools import lru_cache, wraps
+import httpx
+from cachetools import TTLCache
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from typing import Optional, Dict, List, Tuple
 
 # Supabase configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 
-def get_supabase_client() -> Optional[Client]:
-    """Get Supabase client if configured"""
+logger = logging.getLogger(__name__)
+
+# Columns the API returns for a repository (the frontend's Repository type);
+# listed explicitly so columns added to the table later are not fetched by default
+REPOSITORY_COLUMNS = "id,user_id,name,full_name,description,url,created_at,updated_at"
+
+# Shared keep-alive pool for all PostgREST calls
+SUPABASE_POOL_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+
+async def get_supabase_client(http_client: httpx.AsyncClient) -> Optional[AsyncClient]:
+    """Get async Supabase client if configured"""
     if not SUPABASE_URL or not SUPABASE_KEY:
         return None
     
     try:
-        return create_client(SUPABASE_URL, SUPABASE_KEY)
+        return await acreate_client(SUPABASE_URL, SUPABASE_KEY, options=AsyncClientOptions(httpx_client=http_client))
     except Exception as e:
-        print(f"Failed to create Supabase client: {e}")
+        logger.error("Failed to create Supabase client: %s", e)
         return None
 
+def is_constraint_violation(error: Exception) -> bool:
+    """Postgres integrity errors (SQLSTATE class 23, e.g. 23505 unique_violation)"""
+    return isinstance(error, APIError) and str(error.code or "").startswith("23")
+
+class BatchInserter:
+    """Coalesces concurrent inserts into one multi-row INSERT
+
+    Rows are flushed when max_batch_size rows are waiting or max_latency seconds
+    after the first one arrived, whichever comes first. Each submitter gets back
+    its own inserted row, matched on the table's unique `match_column`.
+    """
+    
+    def __init__(self, table: str, match_column: str, max_batch_size: int = 100, max_latency: float = 0.05):
+        self.table = table
+        self.match_column = match_column
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.client: Optional[AsyncClient] = None
+        self._queue: asyncio.Queue[Tuple[Dict, asyncio.Future]] = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+    
+    def start(self, client: AsyncClient):
+        self.client = client
+        self._worker = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(Exception("Supabase client closed"))
+    
+    async def submit(self, row: Dict) -> Dict:
+        """Queue a row and wait for the batch containing it to be inserted"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except TimeoutError:
+                    break
+            
+            await self._flush(batch)
+    
+    async def _flush(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        try:
+            result = await self.client.table(self.table).insert([row for row, _ in batch]).execute()
+        except Exception as e:
+            if len(batch) > 1 and is_constraint_violation(e):
+                # One bad row (e.g. a duplicate) fails the whole statement;
+                # retry individually so only its submitter sees the error
+                for item in batch:
+                    await self._flush([item])
+                return
+            # Timeouts and connection errors would fail each retry the same way
+            # (or hit rows the server did commit), so fail the batch at once
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        inserted = {row[self.match_column]: row for row in result.data or []}
+        for row, future in batch:
+            if future.done():
+                continue
+            if row[self.match_column] in inserted:
+                future.set_result(inserted[row[self.match_column]])
+            else:
+                future.set_exception(Exception("Failed to insert repository"))
+
+# Built once; raised by every repository call while Supabase is not configured
+_NOT_CONFIGURED = RuntimeError("Supabase not configured")
+
+def require_supabase(method):
+    """Raise _NOT_CONFIGURED instead of running the method when no client is connected"""
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if not self.available:
+            # Reset the traceback or it would keep growing with every raise
+            raise _NOT_CONFIGURED.with_traceback(None)
+        return await method(self, *args, **kwargs)
+    return wrapper
+
 class SupabaseRepository:
     """Repository class for Supabase operations"""
     
-    def __init__(self):
-        self.client = get_supabase_client()
+    def __init__(self, cache_size: int = 512):
+        self.client: Optional[AsyncClient] = None
+        self.available = False
+        self._http_client: Optional[httpx.AsyncClient] = None
+        
+        # Read caches; per process, so TTLs bound staleness across workers
+        self.repository_cache: TTLCache = TTLCache(maxsize=cache_size, ttl=30)  # repository_id -> repository
+        self.user_repositories_cache: TTLCache = TTLCache(maxsize=cache_size * 2, ttl=10)  # user_id -> repositories
+        
+        # full_name is UNIQUE in the repositories table
+        self.repository_inserter = BatchInserter("repositories", match_column="full_name")
+    
+    async def connect(self):
+        """Create the async client; called once from the app lifespan"""
+        if self.client is not None or not SUPABASE_URL or not SUPABASE_KEY:
+            return
+        
+        self._http_client = httpx.AsyncClient(limits=SUPABASE_POOL_LIMITS, timeout=10.0)
+        self.client = await get_supabase_client(self._http_client)
         self.available = self.client is not None
+        if self.available:
+            self.repository_inserter.start(self.client)
     
+    async def close(self):
+        await self.repository_inserter.stop()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self.client = None
+        self.available = False
+    
+    @require_supabase
     async def add_repository(self, user_id: str, repo_data: Dict) -> Dict:
         """Add a repository to Supabase"""
-        if not self.available:
-            raise Exception("Supabase not configured")
-        
         repository = {
-            "id": str(uuid.uuid4()),
             "user_id": user_id,
             "name": repo_data["name"],
             "full_name": repo_data["full_name"],
             "description": repo_data.get("description"),
-            "url": repo_data["url"],
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat()
+            "url": repo_data["url"]
+            # id, created_at and updated_at are filled in by the column defaults
         }
         
         try:
-            result = self.client.table("repositories").insert(repository).execute()
-            if result.data:
-                return result.data[0]
-            else:
-                raise Exception("Failed to insert repository")
+            inserted = await self.repository_inserter.submit(repository)
+            self.user_repositories_cache.pop(user_id, None)
+            return inserted
         except Exception as e:
             raise Exception(f"Database error: {str(e)}")
     
+    @require_supabase
     async def get_repositories(self, user_id: str) -> List[Dict]:
         """Get repositories for a user"""
-        if not self.available:
-            raise Exception("Supabase not configured")
+        cached = self.user_repositories_cache.get(user_id)
+        if cached is not None:
+            return cached
         
         try:
-            result = self.client.table("repositories").select("*").eq("user_id", user_id).execute()
-            return result.data if result.data else []
+            result = await self.client.table("repositories").select(REPOSITORY_COLUMNS).eq("user_id", user_id).execute()
+            repositories = result.data if result.data else []
+            self.user_repositories_cache[user_id] = repositories
+            return repositories
         except Exception as e:
             raise Exception(f"Database error: {str(e)}")
     
+    @require_supabase
     async def delete_repository(self, repository_id: str, user_id: str) -> bool:
         """Delete a repository"""
+        try:
+            # Nothing reads the deleted row, so do not send it back
+            await self.client.table("repositories").delete(returning=ReturnMethod.minimal).eq("id", repository_id).eq("user_id", user_id).execute()
+            self.repository_cache.pop(repository_id, None)
+            self.user_repositories_cache.pop(user_id, None)
+            return True
+        except Exception as e:
+            raise Exception(f"Database error: {str(e)}")
+    
+    async def ping(self) -> bool:
+        """Open a pooled connection with a trivial query so the first request does not pay for it"""
         if not self.available:
-            raise Exception("Supabase not configured")
+            return False
         
         try:
-            result = self.client.table("repositories").delete().eq("id", repository_id).eq("user_id", user_id).execute()
+            await self.client.table("repositories").select("id").limit(1).execute()
             return True
         except Exception as e:
-            raise Exception(f"Database error: {str(e)}")
+            logger.warning("Supabase warm-up failed: %s", e)
+            return False
     
+    @require_supabase
     async def get_repository(self, repository_id: str) -> Optional[Dict]:
         """Get a single repository"""
-        if not self.available:
-            raise Exception("Supabase not configured")
+        cached = self.repository_cache.get(repository_id)
+        if cached is not None:
+            return cached
         
         try:
-            result = self.client.table("repositories").select("*").eq("id", repository_id).execute()
-            return result.data[0] if result.data else None
+            result = await self.client.table("repositories").select(REPOSITORY_COLUMNS).eq("id", repository_id).execute()
+            if not result.data:
+                return None
+            self.repository_cache[repository_id] = result.data[0]
+            return result.data[0]
         except Exception as e:
             raise Exception(f"Database error: {str(e)}")
 
-# Global instance
-supabase_repo = SupabaseRepository()
+@lru_cache(maxsize=1)
+def get_supabase_repo() -> SupabaseRepository:
+    """FastAPI dependency returning the process-wide repository"""
+    return SupabaseRepository()